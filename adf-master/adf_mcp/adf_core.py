@@ -4,23 +4,144 @@ ADF检验核心功能实现
 提供ADF检验的核心算法实现，包括统计量计算、p值计算等。
 """
 
+import os
+import hashlib
+import threading
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from typing import Dict, Any, Optional, Union, List
 from scipy import stats
 from statsmodels.tsa.stattools import adfuller
 from statsmodels.tsa.ar_model import AutoReg
 import warnings
 
+from .adf_kernels import adf_fixed_lag, mackinnon_p, mackinnon_crit, REG_CODES, _get_determ
+
+try:
+    import xxhash
+except ImportError:  # xxhash为可选依赖，缺失时使用hashlib计算缓存键
+    xxhash = None
+
 # 忽略statsmodels的警告
 warnings.filterwarnings('ignore', category=UserWarning, module='statsmodels')
 
+# t统计量准则的显著性阈值，与statsmodels保持一致 (stats.norm.ppf(.95))
+_TSTAT_STOP = 1.6448536269514722
+
+# 参数合法取值，在转换数据之前校验
+_VALID_REGRESSIONS = frozenset(REG_CODES)
+_VALID_LAGS_METHODS = frozenset({None, 'aic', 'bic', 't-stat'})
+
+
+def _select_lag(x: np.ndarray, regression: str, maxlag: int, method: str) -> int:
+    """
+    按信息准则选择ADF回归的滞后阶数
+
+    在同一样本上只构造一次maxlag阶设计矩阵，列顺序为
+    [确定项, y_{t-1}, Δy_{t-1}, ..., Δy_{t-maxlag}]，与statsmodels的autolag一致。
+    QR分解的前p列恰好是前p个回归元的分解，因此各阶数的残差平方和可由
+    Q'Δy 的累积平方和直接得到，无需对每个阶数重新拟合OLS。
+
+    Args:
+        x: 时间序列数据
+        regression: 回归类型 ('n', 'c', 'ct')
+        maxlag: 最大滞后阶数
+        method: 滞后选择方法 ('aic', 'bic', 't-stat')
+
+    Returns:
+        选定的滞后阶数
+    """
+    xdiff = np.diff(x)
+    nobs = xdiff.shape[0] - maxlag
+    ntrend = REG_CODES[regression]
+    startlag = ntrend + 1
+
+    design = np.empty((nobs, startlag + maxlag))
+    for j, column in enumerate(_get_determ(nobs)[:ntrend]):
+        design[:, j] = column
+    design[:, startlag - 1] = x[maxlag:-1]
+    for lag in range(1, maxlag + 1):
+        design[:, startlag - 1 + lag] = xdiff[maxlag - lag:maxlag - lag + nobs]
+    endog = xdiff[maxlag:]
+
+    q, _ = np.linalg.qr(design)
+    z = q.T @ endog
+    n_params = np.arange(startlag, startlag + maxlag + 1)
+    ssr = endog @ endog - np.cumsum(z * z)[n_params - 1]
+    ssr = np.maximum(ssr, np.finfo(np.float64).tiny)
+
+    if method == 't-stat':
+        # 最后一个回归元的|t| = |z_p| / sigma；从最高阶开始选择第一个显著的阶数
+        for i in range(maxlag, 0, -1):
+            p = n_params[i]
+            sigma = np.sqrt(ssr[i] / (nobs - p))
+            if abs(z[p - 1]) / sigma >= _TSTAT_STOP:
+                return i
+        return 0
+
+    penalty = 2.0 if method == 'aic' else np.log(nobs)
+    criteria = nobs * np.log(ssr / nobs) + penalty * n_params
+    return int(np.argmin(criteria))
+
+
+def _adf_fixed_lag(x: np.ndarray, regression: str, lags: int):
+    """
+    以固定滞后阶数执行ADF检验
+
+    统计量、MacKinnon近似p值与临界值均由编译内核计算；
+    设计矩阵奇异等内核无法求解的情形回退到statsmodels.adfuller。
+
+    Returns:
+        (统计量, p值, 临界值字典)
+    """
+    reg_code = REG_CODES[regression]
+    try:
+        statistic, nobs = adf_fixed_lag(np.asarray(x, dtype=np.float64), lags, reg_code)
+    except np.linalg.LinAlgError:
+        statistic = np.nan
+    
+    if not np.isfinite(statistic):
+        result = adfuller(x, regression=regression, maxlag=lags, autolag=None)
+        return result[0], result[1], result[4]
+    
+    p_value = mackinnon_p(statistic, reg_code)
+    critical_values = mackinnon_crit(reg_code, nobs)
+    return statistic, p_value, {
+        '1%': critical_values[0],
+        '5%': critical_values[1],
+        '10%': critical_values[2]
+    }
+
+
+def _hash_array(x: np.ndarray):
+    """计算数组内容的摘要，用作结果缓存键"""
+    buf = np.ascontiguousarray(x, dtype=np.float64).tobytes()
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(buf)
+    return hashlib.blake2b(buf, digest_size=16).digest()
+
+
+def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """复制检验结果，避免调用方修改缓存中的字典"""
+    return dict(result, critical_values=dict(result['critical_values']))
+
 
 class ADFTester:
     """ADF检验器类"""
     
-    def __init__(self):
-        """初始化ADF检验器"""
+    def __init__(self, cache_size: int = 256):
+        """
+        初始化ADF检验器
+        
+        Args:
+            cache_size: 检验结果LRU缓存容量，为0时不缓存
+        """
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
         self.regression_types = {
             'n': '无常数项',
             'c': '有常数项', 
@@ -28,6 +149,7 @@ class ADFTester:
         }
         
         self.lags_methods = {
+            None: '固定滞后阶数',
             'aic': 'Akaike信息准则',
             'bic': 'Bayesian信息准则',
             't-stat': 't统计量'
@@ -38,7 +160,8 @@ class ADFTester:
         data: Union[List[float], np.ndarray, pd.Series],
         regression: str = 'c',
         max_lags: int = 10,
-        lags_method: str = 'aic'
+        lags_method: Optional[str] = None,
+        skip_nan_filter: bool = False
     ) -> Dict[str, Any]:
         """
         执行ADF平稳性检验
@@ -47,50 +170,68 @@ class ADFTester:
             data: 时间序列数据
             regression: 回归类型 ('n', 'c', 'ct')
             max_lags: 最大滞后阶数
-            lags_method: 滞后选择方法 ('aic', 'bic', 't')
+            lags_method: 滞后选择方法 ('aic', 'bic', 't-stat')，
+                为None时直接使用max_lags作为固定滞后阶数
+            skip_nan_filter: 调用方已保证数据不含NaN时设为True，省去一次全量扫描
             
         Returns:
             包含检验结果的字典
         """
+        # 验证参数：先于数据转换，非法调用不必承担数组分配与复制
+        if regression not in _VALID_REGRESSIONS:
+            raise ValueError(f"回归类型必须是 {list(self.regression_types.keys())} 之一")
+        
+        if lags_method not in _VALID_LAGS_METHODS:
+            raise ValueError(f"滞后选择方法必须是 {list(self.lags_methods.keys())} 之一")
+        
+        if max_lags < 0:
+            raise ValueError("最大滞后阶数必须非负")
+        
         # 数据预处理
         if isinstance(data, (list, tuple)):
-            data = np.array(data)
+            # np.fromiter按已知长度预分配并逐元素拆箱；含None等元素时回退到np.array（None转为NaN）
+            try:
+                data = np.fromiter(data, dtype=np.float64, count=len(data))
+            except TypeError:
+                data = np.array(data, dtype=np.float64)
         elif isinstance(data, pd.Series):
-            data = data.values
+            data = data.to_numpy(dtype=np.float64, copy=False)
+        
+        # 统一为连续的float64数组，后续哈希与回归内核无需再次转换。
+        # 不降为float32：ADF回归在水平值较大时对精度敏感，而float32仅带来约一成的提速
+        data = np.ascontiguousarray(data, dtype=np.float64)
         
         # 移除NaN值
-        data = data[~np.isnan(data)]
+        if not skip_nan_filter:
+            data = data[~np.isnan(data)]
         
         if len(data) < 10:
             raise ValueError("数据长度必须至少为10个观测值")
         
-        # 验证参数
-        if regression not in self.regression_types:
-            raise ValueError(f"回归类型必须是 {list(self.regression_types.keys())} 之一")
-        
-        if lags_method not in self.lags_methods:
-            raise ValueError(f"滞后选择方法必须是 {list(self.lags_methods.keys())} 之一")
-        
-        if max_lags < 0:
-            raise ValueError("最大滞后阶数必须非负")
-        
         # 限制最大滞后阶数
         max_lags = min(max_lags, len(data) // 2 - 1)
         
+        # 相同数据与参数直接返回缓存结果
+        key = (_hash_array(data), len(data), regression, max_lags, lags_method)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return _copy_result(cached)
+        
         try:
-            # 执行ADF检验
-            result = adfuller(
-                data,
-                regression=regression,
-                maxlag=max_lags,
-                autolag=lags_method
-            )
+            ntrend = len(regression) if regression != 'n' else 0
+            if max_lags > len(data) // 2 - ntrend - 1:
+                raise ValueError("最大滞后阶数必须小于 (数据长度/2 - 1 - 确定项个数)")
+            if data.max() == data.min():
+                raise ValueError("数据为常数序列")
+            
+            # 先按信息准则选定阶数，再以固定阶数执行ADF检验
+            lags_used = max_lags
+            if lags_method is not None:
+                lags_used = _select_lag(data, regression, max_lags, lags_method)
             
-            # 解析结果
-            statistic = result[0]
-            p_value = result[1]
-            critical_values = result[4]
-            lags_used = result[2]
+            statistic, p_value, critical_values = _adf_fixed_lag(data, regression, lags_used)
             
             # 判断是否平稳（基于5%显著性水平）
             is_stationary = bool(p_value < 0.05)
@@ -114,11 +255,29 @@ class ADFTester:
                 'max_lags': max_lags
             }
             
-            return result_dict
+            if self.cache_size > 0:
+                with self._cache_lock:
+                    self._cache[key] = result_dict
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            
+            return _copy_result(result_dict)
             
         except Exception as e:
             raise RuntimeError(f"ADF检验执行失败: {str(e)}")
     
+    def clear_cache(self) -> int:
+        """
+        清空检验结果缓存
+        
+        Returns:
+            被清除的缓存条目数
+        """
+        with self._cache_lock:
+            count = len(self._cache)
+            self._cache.clear()
+        return count
+    
     def get_interpretation(self, result: Dict[str, Any]) -> str:
         """
         获取检验结果的解释
@@ -162,31 +321,39 @@ ADF检验结果解释：
         data_dict: Dict[str, Union[List[float], np.ndarray, pd.Series]],
         regression: str = 'c',
         max_lags: int = 10,
-        lags_method: str = 'aic'
+        lags_method: Optional[str] = None,
+        max_workers: Optional[int] = None
     ) -> Dict[str, Dict[str, Any]]:
         """
         批量执行ADF检验
         
+        各序列分发到线程池中并行检验，OLS求解在BLAS/LAPACK中会释放GIL。
+        
         Args:
             data_dict: 包含多个时间序列的字典
             regression: 回归类型
             max_lags: 最大滞后阶数
             lags_method: 滞后选择方法
+            max_workers: 最大并行线程数，默认为CPU核数
             
         Returns:
-            包含所有检验结果的字典
+            包含所有检验结果的字典，顺序与data_dict一致
         """
-        results = {}
-        
-        for name, data in data_dict.items():
+        def _safe_call(item):
+            name, data = item
             try:
-                results[name] = self.test_stationarity(
+                return name, self.test_stationarity(
                     data, regression, max_lags, lags_method
                 )
             except Exception as e:
-                results[name] = {
+                return name, {
                     'error': str(e),
                     'success': False
                 }
         
-        return results
+        workers = min(max_workers or os.cpu_count() or 1, len(data_dict))
+        if workers <= 1:
+            return dict(map(_safe_call, data_dict.items()))
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(pool.map(_safe_call, data_dict.items()))
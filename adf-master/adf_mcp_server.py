@@ -4,7 +4,15 @@ ADF检验MCP服务器
 专注于统计学检测，无需训练数据
 """
 
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, IO
+import array
+import asyncio
+import base64
+import codecs
+import copy
+import hashlib
+import io
+import json
 import threading
 import uuid
 import os
@@ -12,9 +20,42 @@ import datetime
 import traceback
 import numpy as np
 import pandas as pd
+from collections import OrderedDict
 from fastmcp import FastMCP
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 
 from adf_mcp.adf_core import ADFTester
+from adf_mcp.adf_kernels import summarize
+
+# pyarrow为可选依赖：安装后CSV由多线程的pyarrow解析器读取，否则使用pandas的C解析器
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# threadpoolctl为可选依赖：用于按并发任务数限制BLAS线程数，避免多任务超额占用CPU
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# pandas 2.0起to_datetime默认按首个非空值推断格式，此前版本需显式开启
+PANDAS_INFERS_FORMAT = int(pd.__version__.split(".")[0]) >= 2
+
+# 未指定时间戳格式时依次试探的常见格式
+TIMESTAMP_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y/%m/%d %H:%M:%S",
+    "%d/%b/%Y:%H:%M:%S",
+    "%Y-%m-%d",
+)
 
 # 创建FastMCP实例
 mcp = FastMCP("adf-mcp", debug=True, log_level="DEBUG")
@@ -23,13 +64,40 @@ mcp = FastMCP("adf-mcp", debug=True, log_level="DEBUG")
 adf_tester = ADFTester()
 
 # ---- 后台任务基础设施 ----
+# TASKS_LOCK只保护任务表本身的增删；任务字段的读写由各任务自带的"_lock"保护
 TASKS: Dict[str, Dict[str, Any]] = {}
 TASKS_LOCK = threading.Lock()
 
-# 并发控制
-MAX_CONCURRENT = int(os.getenv("ADF_MAX_CONCURRENT", "2"))
+# 并发控制；小于1的设置会使信号量永远无法获取，按1处理
+MAX_CONCURRENT = max(1, int(os.getenv("ADF_MAX_CONCURRENT", "2")))
 TASKS_SEM = threading.Semaphore(MAX_CONCURRENT)
 
+def _available_cpus() -> int:
+    """当前进程可用的CPU数，Linux下遵循CPU亲和性与cgroup cpuset限制"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# BLAS线程数上限：ADF_BLAS_THREADS优先；用户已通过OMP_NUM_THREADS、OPENBLAS_NUM_THREADS
+# 或MKL_NUM_THREADS指定时保持原设置；否则取 可用CPU数 // ADF_MAX_CONCURRENT。
+# threadpool_limits作用于整个进程，因此在启动时设置一次，而非在各任务中反复切换
+BLAS_THREADS = max(1, int(os.getenv("ADF_BLAS_THREADS", _available_cpus() // MAX_CONCURRENT)))
+_BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+if threadpool_limits is not None and (
+    "ADF_BLAS_THREADS" in os.environ or not any(v in os.environ for v in _BLAS_ENV_VARS)
+):
+    threadpool_limits(limits=BLAS_THREADS, user_api="blas")
+
+# 任务的终止状态；get_task长轮询最多等待LONG_POLL_MAX_TIMEOUT秒
+TERMINAL_STATUSES = frozenset({"succeeded", "failed"})
+LONG_POLL_MAX_TIMEOUT = 300.0
+
+# 文件分析结果缓存：仅在请求携带cache_key时使用，
+# 键同时包含文件大小、修改时间与分析参数，文件变化后自动失效
+FILE_RESULTS: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+FILE_RESULTS_LOCK = threading.Lock()
+FILE_RESULT_CACHE_SIZE = 32
+
 # 中国标准时间 (UTC+08:00)
 TZ_CN = datetime.timezone(datetime.timedelta(hours=8))
 
@@ -50,23 +118,93 @@ def _create_task(task_type: str, params: Dict[str, Any]) -> str:
         "result": None,
         "error": None,
         "traceback": None,
+        "_lock": threading.Lock(),
+        "_exc": None,  # 失败时的traceback.TracebackException（不含帧与局部变量），仅在查询时格式化
+        "_waiters": [],  # 长轮询中等待任务结束的 (事件循环, future)，进入终止状态时统一唤醒
     }
     with TASKS_LOCK:
         TASKS[task_id] = task
     return task_id
 
+def _snapshot(task: Dict[str, Any]) -> Dict[str, Any]:
+    """在任务自身的锁内复制任务，去掉以下划线开头的内部字段"""
+    with task["_lock"]:
+        return {k: v for k, v in task.items() if not k.startswith("_")}
+
 def _set_task(task_id: str, **updates):
-    with TASKS_LOCK:
-        if task_id in TASKS:
-            TASKS[task_id].update(**updates)
+    task = TASKS.get(task_id)
+    if task is not None:
+        waiters = ()
+        with task["_lock"]:
+            task.update(updates)
+            if updates.get("status") in TERMINAL_STATUSES:
+                waiters, task["_waiters"] = task["_waiters"], []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:
+                pass  # 事件循环已关闭
 
-def _get_task(task_id: str) -> Dict[str, Any]:
-    with TASKS_LOCK:
-        return dict(TASKS.get(task_id, {}))
+def _wake(fut: "asyncio.Future"):
+    if not fut.done():
+        fut.set_result(None)
+
+async def _wait_terminal(task: Dict[str, Any], timeout: float):
+    """在事件循环上等待任务进入终止状态，至多timeout秒；等待期间不占用任何线程"""
+    loop = asyncio.get_running_loop()
+    waiter = (loop, loop.create_future())
+    with task["_lock"]:
+        if task["status"] in TERMINAL_STATUSES:
+            return
+        task["_waiters"].append(waiter)
+    try:
+        await asyncio.wait_for(waiter[1], timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with task["_lock"]:
+            if waiter in task["_waiters"]:
+                task["_waiters"].remove(waiter)
+
+def _set_progress(task_id: str, progress: float):
+    """只更新任务进度：直接写入单个字段，省去_set_task的关键字参数打包与终止状态检查"""
+    task = TASKS.get(task_id)
+    if task is not None:
+        with task["_lock"]:
+            task["progress"] = progress
+
+def _get_task(task_id: str, include_traceback: bool = False) -> Dict[str, Any]:
+    task = TASKS.get(task_id)
+    if task is None:
+        return {}
+    snapshot = _snapshot(task)
+    exc = task["_exc"]
+    if include_traceback and exc is not None:
+        snapshot["traceback"] = "".join(exc.format())
+    return snapshot
 
 def _list_tasks() -> List[Dict[str, Any]]:
     with TASKS_LOCK:
-        return [dict(t) for t in TASKS.values()]
+        tasks = tuple(TASKS.values())
+    return [_snapshot(t) for t in tasks]
+
+def _get_file_result(memo_key: Optional[tuple]) -> Optional[Dict[str, Any]]:
+    if memo_key is None:
+        return None
+    with FILE_RESULTS_LOCK:
+        result = FILE_RESULTS.get(memo_key)
+        if result is not None:
+            FILE_RESULTS.move_to_end(memo_key)
+    return copy.deepcopy(result) if result is not None else None
+
+def _put_file_result(memo_key: Optional[tuple], result: Dict[str, Any]):
+    if memo_key is None:
+        return
+    with FILE_RESULTS_LOCK:
+        FILE_RESULTS[memo_key] = copy.deepcopy(result)
+        FILE_RESULTS.move_to_end(memo_key)
+        while len(FILE_RESULTS) > FILE_RESULT_CACHE_SIZE:
+            FILE_RESULTS.popitem(last=False)
 
 def _start_background(target, *args):
     t = threading.Thread(target=target, args=args, daemon=True)
@@ -81,7 +219,7 @@ def adf_test(
     data: List[float],
     regression: str = "c",
     max_lags: int = 10,
-    lags_method: str = "aic"
+    lags_method: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     对单个时间序列进行ADF平稳性检验。
@@ -90,20 +228,63 @@ def adf_test(
     - data: List[float] - 时间序列数据
     - regression: str - 回归类型，默认为'c'
     - max_lags: int - 最大滞后阶数，默认为10
-    - lags_method: str - 滞后选择方法，默认为'aic'
+    - lags_method: str, optional - 滞后选择方法 ('aic', 'bic', 't-stat')，默认为None即使用固定滞后阶数max_lags
     
     返回:
     - dict: 检验结果
     """
     try:
+        if regression not in {'n', 'c', 'ct'}:
+            return {"status": "failed", "error": "回归类型必须是 'n', 'c', 'ct' 之一"}
+        
+        if lags_method not in {None, 'aic', 'bic', 't-stat'}:
+            return {"status": "failed", "error": "滞后选择方法必须是 None, 'aic', 'bic', 't-stat' 之一"}
+        
         if not data or len(data) < 10:
             return {"status": "failed", "error": "数据长度必须至少为10个观测值"}
         
-        if regression not in ['n', 'c', 'ct']:
+        result = adf_tester.test_stationarity(data, regression, max_lags, lags_method)
+        return {"status": "success", "result": result}
+        
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+
+
+# 工具：adf_test_bin
+# 作用：以二进制编码传输长序列，对单个时间序列进行ADF检验
+@mcp.tool()
+def adf_test_bin(
+    data_b64: str,
+    regression: str = "c",
+    max_lags: int = 10,
+    lags_method: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    对Base64编码的float64序列进行ADF平稳性检验，适合JSON数组过长的情形。
+    
+    参数:
+    - data_b64: str - 小端float64数组原始字节的Base64编码，如 base64.b64encode(np.asarray(x, "<f8").tobytes())
+    - regression: str - 回归类型，默认为'c'
+    - max_lags: int - 最大滞后阶数，默认为10
+    - lags_method: str, optional - 滞后选择方法 ('aic', 'bic', 't-stat')，默认为None即使用固定滞后阶数max_lags
+    
+    返回:
+    - dict: 检验结果
+    """
+    try:
+        if regression not in {'n', 'c', 'ct'}:
             return {"status": "failed", "error": "回归类型必须是 'n', 'c', 'ct' 之一"}
         
-        if lags_method not in ['aic', 'bic', 't-stat']:
-            return {"status": "failed", "error": "滞后选择方法必须是 'aic', 'bic', 't-stat' 之一"}
+        if lags_method not in {None, 'aic', 'bic', 't-stat'}:
+            return {"status": "failed", "error": "滞后选择方法必须是 None, 'aic', 'bic', 't-stat' 之一"}
+        
+        raw = base64.b64decode(data_b64, validate=True)
+        if len(raw) % 8:
+            return {"status": "failed", "error": "数据字节数必须是8的整数倍（float64）"}
+        
+        data = np.frombuffer(raw, dtype="<f8")
+        if len(data) < 10:
+            return {"status": "failed", "error": "数据长度必须至少为10个观测值"}
         
         result = adf_tester.test_stationarity(data, regression, max_lags, lags_method)
         return {"status": "success", "result": result}
@@ -119,7 +300,7 @@ def adf_batch_test(
     data_dict: Dict[str, List[float]],
     regression: str = "c",
     max_lags: int = 10,
-    lags_method: str = "aic"
+    lags_method: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     批量检验多个时间序列的平稳性。
@@ -128,7 +309,7 @@ def adf_batch_test(
     - data_dict: Dict[str, List[float]] - 包含多个时间序列的字典
     - regression: str - 回归类型，默认为'c'
     - max_lags: int - 最大滞后阶数，默认为10
-    - lags_method: str - 滞后选择方法，默认为'aic'
+    - lags_method: str, optional - 滞后选择方法 ('aic', 'bic', 't-stat')，默认为None即使用固定滞后阶数max_lags
     
     返回:
     - dict: 批量检验结果
@@ -137,17 +318,20 @@ def adf_batch_test(
         if not data_dict:
             return {"status": "failed", "error": "数据字典不能为空"}
         
+        # 长度合格的序列交给线程池并行检验，并发数受ADF_MAX_CONCURRENT限制
+        valid = {name: data for name, data in data_dict.items() if len(data) >= 10}
+        tested = adf_tester.batch_test(
+            valid, regression, max_lags, lags_method, max_workers=MAX_CONCURRENT
+        )
+        
         results = {}
-        for name, data in data_dict.items():
-            try:
-                if len(data) < 10:
-                    results[name] = {"status": "failed", "error": "数据长度必须至少为10个观测值"}
-                    continue
-                
-                result = adf_tester.test_stationarity(data, regression, max_lags, lags_method)
-                results[name] = {"status": "success", "result": result}
-            except Exception as e:
-                results[name] = {"status": "failed", "error": str(e)}
+        for name in data_dict:
+            if name not in tested:
+                results[name] = {"status": "failed", "error": "数据长度必须至少为10个观测值"}
+            elif tested[name].get("success") is False:
+                results[name] = {"status": "failed", "error": tested[name]["error"]}
+            else:
+                results[name] = {"status": "success", "result": tested[name]}
         
         return {"status": "success", "results": results}
         
@@ -190,6 +374,26 @@ def adf_interpret(
         return {"status": "failed", "error": str(e)}
 
 
+# 工具：adf_clear_cache
+# 作用：清空ADF检验结果缓存
+@mcp.tool()
+def adf_clear_cache() -> Dict[str, Any]:
+    """
+    清空ADF检验结果缓存与文件分析结果缓存。
+    
+    返回:
+    - dict: {"status": "success", "cleared": int, "cleared_file_results": int}
+    """
+    with FILE_RESULTS_LOCK:
+        cleared_file_results = len(FILE_RESULTS)
+        FILE_RESULTS.clear()
+    return {
+        "status": "success",
+        "cleared": adf_tester.clear_cache(),
+        "cleared_file_results": cleared_file_results
+    }
+
+
 # 工具：adf_analyze_file
 # 作用：通过文件路径直接分析数据（AI可直接调用）
 @mcp.tool()
@@ -198,12 +402,16 @@ def adf_analyze_file(
     txt: Optional[str] = None,
     timestamp_col: str = "Date",
     value_col: str = "EventId",
+    timestamp_format: Optional[str] = None,
     delimiter: str = " ",
     has_header: bool = True,
     regression: str = "c",
     max_lags: int = 10,
-    lags_method: str = "aic",
-    analysis_type: str = "log_analysis"
+    lags_method: Optional[str] = None,
+    analysis_type: str = "log_analysis",
+    fill_gaps: bool = True,
+    return_initial_state: bool = False,
+    cache_key: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     通过文件路径直接分析数据并执行ADF检验（AI可直接调用）。
@@ -213,27 +421,36 @@ def adf_analyze_file(
     - txt: str, optional - TXT文件路径，与csv二选一
     - timestamp_col: str - 时间戳列名（CSV文件）
     - value_col: str - 数值列名（CSV文件）
+    - timestamp_format: str, optional - 时间戳格式，如'%Y-%m-%d %H:%M:%S'（CSV文件），默认按首行自动推断
     - delimiter: str - 分隔符（TXT文件）
     - has_header: bool - 是否有标题行（TXT文件）
     - regression: str - 回归类型，默认为'c'
     - max_lags: int - 最大滞后阶数，默认为10
-    - lags_method: str - 滞后选择方法，默认为'aic'
+    - lags_method: str, optional - 滞后选择方法 ('aic', 'bic', 't-stat')，默认为None即使用固定滞后阶数max_lags
     - analysis_type: str - 分析类型 ("log_analysis", "full", "quick")
+    - fill_gaps: bool - 日志分析时是否将无事件的分钟计为0，默认为True；
+      为False时仅保留出现过事件的分钟，序列变为按时间排序的非等间隔计数，适合时间戳稀疏的日志
+    - return_initial_state: bool - 是否在响应的initial_state字段中附带任务的当前快照，省去一次get_task请求
+    - cache_key: str, optional - 客户端提供的缓存键（如文件大小:修改时间:参数摘要）；提供时，
+      同一文件（大小与修改时间未变）以相同参数重复分析将直接返回缓存结果
     
     返回:
-    - dict: {"status": "queued", "task_id": str, "type": "adf_analyze_file"}
+    - dict: {"status": "queued", "task_id": str, "type": "adf_analyze_file"}，
+      命中缓存时status为"succeeded"且cached为True
     """
     params = {
         "csv": csv,
         "txt": txt,
         "timestamp_col": timestamp_col,
         "value_col": value_col,
+        "timestamp_format": timestamp_format,
         "delimiter": delimiter,
         "has_header": has_header,
         "regression": regression,
         "max_lags": max_lags,
         "lags_method": lags_method,
         "analysis_type": analysis_type,
+        "fill_gaps": fill_gaps,
     }
     
     # 参数验证
@@ -241,23 +458,190 @@ def adf_analyze_file(
         msg = "请指定csv或txt文件路径中的一个"
         task_id = _create_task("adf_analyze_file", params)
         _set_task(task_id, status="failed", error=msg, completed_at=_now_iso())
-        return {"status": "failed", "task_id": task_id, "type": "adf_analyze_file", "error": msg}
+        return _with_initial_state(
+            {"status": "failed", "task_id": task_id, "type": "adf_analyze_file", "error": msg},
+            return_initial_state
+        )
     
     # 检查文件是否存在
     file_path = csv or txt
-    if not os.path.exists(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
         msg = f"文件不存在: {file_path}"
         task_id = _create_task("adf_analyze_file", params)
         _set_task(task_id, status="failed", error=msg, completed_at=_now_iso())
-        return {"status": "failed", "task_id": task_id, "type": "adf_analyze_file", "error": msg}
+        return _with_initial_state(
+            {"status": "failed", "task_id": task_id, "type": "adf_analyze_file", "error": msg},
+            return_initial_state
+        )
+    
+    # 缓存键由服务端自行核对文件状态，客户端的cache_key过期时不会命中
+    memo_key = None
+    if cache_key is not None:
+        memo_key = (
+            cache_key, os.path.abspath(file_path), st.st_size, st.st_mtime_ns,
+            tuple(sorted(params.items()))
+        )
+    
+    return _submit_file_analysis(params, memo_key, return_initial_state)
+
+
+# 路由：POST /upload/adf_analyze_file
+# 作用：上传文件并提交分析任务，适用于服务器与客户端不共享文件系统的部署
+@mcp.custom_route("/upload/adf_analyze_file", methods=["POST"])
+async def upload_analyze_file(request: Request) -> JSONResponse:
+    """
+    以multipart/form-data上传CSV/TXT文件并提交分析任务。
+    
+    表单字段:
+    - file: 上传的文件，文件名以.txt结尾时按TXT解析，否则按CSV解析
+    - metadata: JSON对象字符串，字段与adf_analyze_file的参数相同（csv、txt除外），均可省略；
+      另可提供file_size（客户端文件的字节数），与实际收到的字节数不一致时返回400。
+      未知字段被忽略，已知字段类型不符时返回400
+    
+    上传文件由Starlette暂存（小文件在内存中，大文件溢出到临时文件），解析器直接读取该文件对象，
+    不再复制一份；任务结束后关闭。返回值与adf_analyze_file相同。
+    """
+    form = await request.form()
+    upload = form.get("file")
+    if upload is None or isinstance(upload, str):
+        await form.close()
+        return JSONResponse({"status": "failed", "error": "缺少上传文件字段file"}, status_code=400)
+    try:
+        options = json.loads(form.get("metadata") or "{}")
+    except ValueError:
+        options = None
+    error = _check_upload_options(options)
+    if error is not None:
+        await form.close()
+        return JSONResponse({"status": "failed", "error": error}, status_code=400)
+    if "file_size" in options and options["file_size"] != _upload_size(upload):
+        await form.close()
+        return JSONResponse(
+            {"status": "failed", "error": "上传内容不完整：收到的字节数与file_size不一致"}, status_code=400
+        )
+    filename = upload.filename or "upload"
+    
+    file_type = "txt" if filename.lower().endswith(".txt") else "csv"
+    params = {
+        "csv": None,
+        "txt": None,
+        "timestamp_col": options.get("timestamp_col", "Date"),
+        "value_col": options.get("value_col", "EventId"),
+        "timestamp_format": options.get("timestamp_format"),
+        "delimiter": options.get("delimiter", " "),
+        "has_header": options.get("has_header", True),
+        "regression": options.get("regression", "c"),
+        "max_lags": options.get("max_lags", 10),
+        "lags_method": options.get("lags_method"),
+        "analysis_type": options.get("analysis_type", "log_analysis"),
+        "fill_gaps": options.get("fill_gaps", True),
+    }
+    params[file_type] = f"upload:{filename}"
+    
+    # 上传内容没有修改时间可核对，以分块计算的内容摘要代替
+    memo_key = None
+    if options.get("cache_key") is not None:
+        digest = hashlib.blake2b(digest_size=16)
+        while True:
+            chunk = await upload.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+        await upload.seek(0)
+        memo_key = (options["cache_key"], digest.digest(), json.dumps(params, sort_keys=True))
     
+    return JSONResponse(_submit_file_analysis(
+        params, memo_key, options.get("return_initial_state", False), upload.file
+    ))
+
+
+# 上传metadata中已知字段允许的类型；bool是int的子类，需单独排除
+_UPLOAD_OPTION_TYPES = {
+    "timestamp_col": (str,),
+    "value_col": (str,),
+    "timestamp_format": (str, type(None)),
+    "delimiter": (str,),
+    "has_header": (bool,),
+    "regression": (str,),
+    "max_lags": (int,),
+    "lags_method": (str, type(None)),
+    "analysis_type": (str,),
+    "fill_gaps": (bool,),
+    "return_initial_state": (bool,),
+    "cache_key": (str, type(None)),
+    "file_size": (int,),
+}
+
+
+def _upload_size(upload) -> int:
+    """上传文件的字节数；旧版Starlette的UploadFile没有size属性时定位到末尾获取"""
+    size = getattr(upload, "size", None)
+    if size is None:
+        size = upload.file.seek(0, os.SEEK_END)
+        upload.file.seek(0)
+    return size
+
+
+def _check_upload_options(options: Any) -> Optional[str]:
+    """检查上传metadata的结构与字段类型，合法时返回None，否则返回错误信息"""
+    if not isinstance(options, dict):
+        return "metadata必须是合法的JSON对象"
+    for name, types in _UPLOAD_OPTION_TYPES.items():
+        if name not in options:
+            continue
+        value = options[name]
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            return f"metadata字段 {name} 的类型不正确"
+    return None
+
+
+def _submit_file_analysis(
+    params: Dict[str, Any],
+    memo_key: Optional[tuple],
+    return_initial_state: bool,
+    source: Optional[IO[bytes]] = None
+) -> Dict[str, Any]:
+    """创建文件分析任务：命中结果缓存时直接完成，否则交给后台线程执行"""
     task_id = _create_task("adf_analyze_file", params)
-    _start_background(_analyze_file_worker, task_id, params)
-    return {"status": "queued", "task_id": task_id, "type": "adf_analyze_file"}
+    cached = _get_file_result(memo_key)
+    if cached is not None:
+        now = _now_iso()
+        _set_task(task_id, status="succeeded", progress=1.0, started_at=now, completed_at=now, result=cached)
+        if source is not None:
+            source.close()
+        return _with_initial_state(
+            {"status": "succeeded", "task_id": task_id, "type": "adf_analyze_file", "cached": True},
+            return_initial_state
+        )
+    
+    _start_background(_analyze_file_worker, task_id, params, memo_key, source)
+    return _with_initial_state(
+        {"status": "queued", "task_id": task_id, "type": "adf_analyze_file"},
+        return_initial_state
+    )
+
+
+def _with_initial_state(response: Dict[str, Any], return_initial_state: bool) -> Dict[str, Any]:
+    """按需在提交响应中附带任务的当前快照"""
+    if return_initial_state:
+        response["initial_state"] = _get_task(response["task_id"])
+    return response
 
 
-def _analyze_file_worker(task_id: str, params: Dict[str, Any]):
-    """文件分析后台工作线程"""
+def _analyze_file_worker(
+    task_id: str,
+    params: Dict[str, Any],
+    memo_key: Optional[tuple] = None,
+    source: Optional[IO[bytes]] = None
+):
+    """
+    文件分析后台工作线程
+    
+    memo_key不为None时缓存成功的分析结果；source为上传的文件对象，
+    提供时代替params中的路径作为解析来源，任务结束后关闭。
+    """
     try:
         with TASKS_SEM:
             _set_task(task_id, status="running", started_at=_now_iso(), progress=0.1)
@@ -274,49 +658,54 @@ def _analyze_file_worker(task_id: str, params: Dict[str, Any]):
                 file_path = txt_path
                 file_type = "txt"
             
-            _set_task(task_id, progress=0.2)
+            _set_progress(task_id, 0.2)
+            
+            # 解析来源：上传的缓冲区或本地路径
+            src = file_path if source is None else source
             
             # 读取数据
             if file_type == "csv":
-                df = pd.read_csv(file_path)
-                
-                # 检查必需的列
-                if params["timestamp_col"] not in df.columns:
+                # 只读取表头检查必需的列
+                columns = pd.read_csv(src, nrows=0).columns
+                _rewind(source)
+                if params["timestamp_col"] not in columns:
                     _set_task(task_id, status="failed", error=f"时间戳列 '{params['timestamp_col']}' 不存在", completed_at=_now_iso())
                     return
                 
-                if params["value_col"] not in df.columns:
+                if params["value_col"] not in columns:
                     _set_task(task_id, status="failed", error=f"数值列 '{params['value_col']}' 不存在", completed_at=_now_iso())
                     return
                 
-                # 提取时间序列数据
+                # 提取时间序列数据，仅解析实际用到的列
                 if analysis_type == "log_analysis":
-                    # 日志数据分析：按时间窗口聚合事件计数
-                    df[params["timestamp_col"]] = pd.to_datetime(df[params["timestamp_col"]])
-                    df = df.set_index(params["timestamp_col"])
-                    time_series = df.resample('1min').size().values
+                    # 日志数据分析：按时间窗口聚合事件计数。未指定格式时时间戳在读取时直接解析；
+                    # 指定格式时按文本读取再按该格式解析，避免pyarrow引擎自行识别日期而绕过格式
+                    ts_col = params["timestamp_col"]
+                    timestamp_format = params.get("timestamp_format")
+                    if timestamp_format is None:
+                        read_kwargs = {"parse_dates": [ts_col]}
+                    else:
+                        read_kwargs = {"dtype": {ts_col: str}}
+                    df = pd.read_csv(src, usecols=[ts_col], engine=CSV_ENGINE, **read_kwargs)
+                    time_series = _minute_counts(df[ts_col], timestamp_format, params["fill_gaps"])
                 else:
                     # 标准分析：直接使用数值列
-                    time_series = df[params["value_col"]].values
+                    value_col = params["value_col"]
+                    df = pd.read_csv(src, usecols=[value_col], dtype={value_col: "float64"}, engine=CSV_ENGINE)
+                    time_series = df[value_col].to_numpy()
             else:
-                # TXT文件处理
-                data = []
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                    if params["has_header"]:
-                        lines = lines[1:]  # 跳过标题行
-                    
-                    for line in lines:
-                        values = line.strip().split(params["delimiter"])
-                        for value in values:
-                            try:
-                                data.append(float(value))
-                            except ValueError:
-                                continue
-                
-                time_series = np.array(data)
+                # TXT文件处理：优先由np.loadtxt整体解析，格式不规整时回退到逐行流式解析
+                try:
+                    time_series = np.loadtxt(
+                        src, delimiter=params["delimiter"],
+                        skiprows=1 if params["has_header"] else 0,  # 跳过标题行
+                        dtype=np.float64, ndmin=1, comments=None
+                    ).ravel()
+                except (ValueError, TypeError):
+                    _rewind(source)
+                    time_series = _read_txt_values(src, params["delimiter"], params["has_header"])
             
-            _set_task(task_id, progress=0.5)
+            _set_progress(task_id, 0.5)
             
             # 数据验证
             if len(time_series) < 10:
@@ -330,17 +719,21 @@ def _analyze_file_worker(task_id: str, params: Dict[str, Any]):
                 _set_task(task_id, status="failed", error="有效数据长度必须至少为10个观测值", completed_at=_now_iso())
                 return
             
-            _set_task(task_id, progress=0.7)
+            _set_progress(task_id, 0.7)
             
-            # 执行ADF检验
+            # 执行ADF检验（NaN已在上方移除）
             adf_result = adf_tester.test_stationarity(
                 time_series,
                 regression=params["regression"],
                 max_lags=params["max_lags"],
-                lags_method=params["lags_method"]
+                lags_method=params["lags_method"],
+                skip_nan_filter=True
             )
             
-            _set_task(task_id, progress=0.9)
+            _set_progress(task_id, 0.9)
+            
+            # 单次遍历得到数据摘要
+            ts_min, ts_max, ts_mean, ts_std = summarize(time_series)
             
             # 构建结果
             result = {
@@ -351,10 +744,10 @@ def _analyze_file_worker(task_id: str, params: Dict[str, Any]):
                 "data_summary": {
                     "time_series_length": len(time_series),
                     "value_range": {
-                        "min": float(np.min(time_series)),
-                        "max": float(np.max(time_series)),
-                        "mean": float(np.mean(time_series)),
-                        "std": float(np.std(time_series))
+                        "min": float(ts_min),
+                        "max": float(ts_max),
+                        "mean": float(ts_mean),
+                        "std": float(ts_std)
                     }
                 },
                 "adf_result": adf_result,
@@ -362,11 +755,118 @@ def _analyze_file_worker(task_id: str, params: Dict[str, Any]):
                 "recommendations": _generate_recommendations(adf_result, len(time_series))
             }
             
+            _put_file_result(memo_key, result)
             _set_task(task_id, status="succeeded", progress=1.0, completed_at=_now_iso(), result=result)
             
     except Exception as ex:
-        _set_task(task_id, status="failed", completed_at=_now_iso(), 
-                 error=str(ex), traceback=traceback.format_exc())
+        # 只保存不含帧对象的堆栈摘要（源码行在get_task请求时才读取并格式化）；
+        # 随后断开traceback，避免失败任务通过帧长期持有上传内容、DataFrame等中间数据
+        exc = traceback.TracebackException.from_exception(ex, lookup_lines=False)
+        ex.__traceback__ = None
+        _set_task(task_id, status="failed", completed_at=_now_iso(), error=str(ex), _exc=exc)
+    finally:
+        if source is not None:
+            source.close()
+
+
+def _rewind(source: Optional[IO[bytes]]):
+    """上传缓冲区需被多次解析时回到开头；本地路径每次重新打开，无需处理"""
+    if source is not None:
+        source.seek(0)
+
+
+def _read_txt_values(file_path, delimiter: str, has_header: bool) -> np.ndarray:
+    """
+    逐行流式解析TXT文件中的数值
+    
+    file_path可以是路径或二进制文件对象（上传缓冲区）。无法解析为数值的字段直接跳过；
+    数值累积在C层的double缓冲区中，不会把整个文件读入内存。
+    """
+    values = array.array('d')
+    append = values.append
+    if isinstance(file_path, (str, os.PathLike)):
+        f = open(file_path, 'r')
+    elif isinstance(file_path, io.IOBase):
+        f = io.TextIOWrapper(file_path, encoding='utf-8')
+    else:
+        # Python 3.11之前的SpooledTemporaryFile不是IOBase，不能直接套TextIOWrapper
+        f = codecs.getreader('utf-8')(file_path)
+    with f:
+        if has_header:
+            next(f, None)  # 跳过标题行
+        for line in f:
+            for value in line.strip().split(delimiter):
+                try:
+                    append(float(value))
+                except ValueError:
+                    continue
+    return np.frombuffer(values, dtype=np.float64)
+
+
+def _guess_timestamp_format(values: pd.Series) -> Optional[str]:
+    """用首个非空时间戳试探常见格式，均不匹配时返回None"""
+    first = values.first_valid_index()
+    if first is None:
+        return None
+    
+    sample = str(values[first]).strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            datetime.datetime.strptime(sample, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_timestamps(values: pd.Series, timestamp_format: Optional[str] = None) -> pd.Series:
+    """
+    解析时间戳列
+    
+    按给定或推断出的固定格式解析，避免逐行回退到dateutil；
+    推断出的格式不适用于全部行时退回默认解析。
+    """
+    fmt = timestamp_format or _guess_timestamp_format(values)
+    if fmt is not None:
+        try:
+            return pd.to_datetime(values, format=fmt, utc=True, cache=True)
+        except ValueError:
+            if timestamp_format is not None:
+                raise
+    
+    kwargs = {} if PANDAS_INFERS_FORMAT else {"infer_datetime_format": True}
+    return pd.to_datetime(values, utc=True, cache=True, **kwargs)
+
+
+def _minute_counts(
+    timestamps: pd.Series,
+    timestamp_format: Optional[str] = None,
+    fill_gaps: bool = True
+) -> np.ndarray:
+    """
+    按分钟统计事件数
+    
+    时间戳转换为整数分钟后计数。fill_gaps为True时由np.bincount一次计数，
+    空缺的分钟计为0，结果与 resample('1min').size() 一致，但开销随首尾跨度增长；
+    为False时改用np.unique，只返回出现过事件的分钟的计数，开销只与事件数有关。
+    给定timestamp_format时总是按该格式解析。
+    """
+    if timestamp_format is not None or not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = _parse_timestamps(timestamps, timestamp_format)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert(None)
+    
+    minutes = timestamps.to_numpy(dtype="datetime64[m]")
+    minutes = minutes[~np.isnat(minutes)].view(np.int64)
+    if minutes.size == 0:
+        return np.empty(0)
+    
+    if not fill_gaps:
+        _, counts = np.unique(minutes, return_counts=True)
+        return counts.astype(np.float64)
+    
+    minutes -= minutes.min()
+    return np.bincount(minutes).astype(np.float64)
 
 
 def _generate_recommendations(adf_result: Dict, data_length: int) -> List[str]:
@@ -403,19 +903,85 @@ def list_tasks() -> Dict[str, Any]:
 # 工具：get_task
 # 作用：查询指定任务的状态、进度与结果
 @mcp.tool()
-def get_task(task_id: str) -> Dict[str, Any]:
+async def get_task(
+    task_id: str,
+    include_traceback: bool = False,
+    wait_until: Optional[str] = None,
+    timeout: float = 30.0
+) -> Dict[str, Any]:
     """
-    获取指定任务的详细状态。
+    获取指定任务的详细状态，可长轮询等待任务结束。
     
     参数:
     - task_id: str - 任务ID
+    - include_traceback: bool - 任务失败时是否在traceback字段中返回完整堆栈，默认为False
+    - wait_until: str, optional - 为"terminal"时阻塞至任务成功或失败再返回，默认为None即立即返回
+    - timeout: float - 长轮询的最长等待秒数，默认为30，上限为300；超时后返回当前状态
     
     返回:
     - dict: 任务详细信息
     """
-    return _get_task(task_id)
+    if wait_until not in {None, "terminal"}:
+        return {"status": "failed", "error": "wait_until必须是 None, 'terminal' 之一"}
+    
+    task = TASKS.get(task_id)
+    if wait_until is not None and task is not None:
+        await _wait_terminal(task, min(max(timeout, 0.0), LONG_POLL_MAX_TIMEOUT))
+    return _get_task(task_id, include_traceback)
+
+
+# 路由：POST /tasks/wait
+# 作用：以普通HTTP请求长轮询任务，供不走MCP协议的客户端（如上传文件后）等待结果
+@mcp.custom_route("/tasks/wait", methods=["POST"])
+async def wait_task(request: Request) -> JSONResponse:
+    """
+    等待任务进入终止状态（成功或失败）后返回任务快照，超时后返回当前状态。
+    
+    请求体(JSON):
+    - task_id: str - 任务ID
+    - timeout: float - 最长等待秒数，默认为30，上限为300
+    - include_traceback: bool - 任务失败时是否返回完整堆栈，默认为False
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"status": "failed", "error": "请求体不是合法的JSON"}, status_code=400)
+    if not isinstance(body, dict) or not isinstance(body.get("task_id"), str):
+        return JSONResponse({"status": "failed", "error": "请求体必须是包含task_id字符串的JSON对象"}, status_code=400)
+    timeout = body.get("timeout", 30.0)
+    include_traceback = body.get("include_traceback", False)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not isinstance(include_traceback, bool):
+        return JSONResponse({"status": "failed", "error": "timeout必须是数值，include_traceback必须是布尔值"}, status_code=400)
+    
+    task = TASKS.get(body["task_id"])
+    if task is None:
+        return JSONResponse({"status": "failed", "error": f"任务不存在: {body['task_id']}"}, status_code=404)
+    await _wait_terminal(task, min(max(float(timeout), 0.0), LONG_POLL_MAX_TIMEOUT))
+    return JSONResponse(_get_task(body["task_id"], include_traceback))
+
+
+class _JSONRouteGZip:
+    """
+    仅对自定义JSON路由按Accept-Encoding启用gzip压缩
+    
+    SSE流等其他路径原样透传：较旧版本的GZipMiddleware不排除text/event-stream，会缓冲事件流。
+    """
+    
+    def __init__(self, app, paths, minimum_size: int = 500):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.paths = frozenset(paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
 
 
 if __name__ == "__main__":
-    # 启动SSE传输的MCP服务器，默认端口2230
-    mcp.run(transport="sse", port=2230)
\ No newline at end of file
+    # 启动SSE传输的MCP服务器，默认端口2230；任务快照等JSON响应按需gzip压缩
+    mcp.run(
+        transport="sse", port=2230,
+        middleware=[Middleware(_JSONRouteGZip, paths=("/upload/adf_analyze_file", "/tasks/wait"))]
+    )
\ No newline at end of file
@@ -28,9 +28,17 @@ setuptools.setup(
         "tqdm>=4.67.0",
     ],
     extras_require={
+        "fast": [
+            "pyarrow>=7.0.0",
+            "numba>=0.56.0",
+            "xxhash>=3.0.0",
+            "threadpoolctl>=3.0.0",
+        ],
         "dev": [
             "pytest>=6.0",
             "pytest-asyncio>=0.21.0",
+            "httpx>=0.24.0",
+            "orjson>=3.6.0",
             "black>=22.0",
             "isort>=5.0",
             "mypy>=0.950",
@@ -2,48 +2,166 @@
 测试文件分析功能
 """
 
-import requests
+import httpx
 import json
-import time
 import os
+import sys
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# orjson为可选依赖：请求体直接序列化为UTF-8字节，响应体由C扩展解析
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    _loads = json.loads
+
+# h2为可选依赖（httpx[http2]）：安装后对支持HTTP/2的服务器启用多路复用与HPACK头部压缩，
+# 否则使用HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# 服务器URL
+BASE_URL = "http://localhost:2230"
+
+# 所有请求共用同一个客户端（线程安全），提交、轮询与连接测试复用连接池中的连接
+SESSION = httpx.Client(
+    base_url=BASE_URL,
+    http2=HTTP2,
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    headers={"Accept": "application/json"},
+)
 
+# 连接阶段的失败：服务器尚未收到请求
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
 
-def test_file_analysis():
-    """测试文件分析功能"""
+# 上传文件的超时时间（秒）：大文件的上传与受理可能超过普通请求的超时
+SUBMIT_TIMEOUT = 60
+HEALTH_CHECK_WAIT = 1  # 等待健康检查结果的秒数
+TEST_FILE_PATH = r"E:\software\MCP_Proj\100MCP\adf-master\OpenSSH_2k.log_structured.csv"
+
+# 分析参数在各次提交间不变，导入时序列化一次；提交时只追加文件指纹字段
+ANALYSIS_REQUEST = {
+    "file_type": "csv",
+    "analysis_type": "log_analysis",
+    "time_window": "1min",
+    "aggregation_method": "count",
+    "regression": "c",
+    "max_lags": 10,
+    "lags_method": "aic",
+    "save_model": True,
+    "model_name": "test_openssh_analysis",
+    "return_initial_state": True
+}
+_ANALYSIS_BODY = _dumps(ANALYSIS_REQUEST)
+_ANALYSIS_BODY_PREFIX = _ANALYSIS_BODY[:-1]  # 去掉末尾的"}"，供追加字段
+_ANALYSIS_DIGEST = hashlib.blake2b(_ANALYSIS_BODY, digest_size=16).hexdigest()
+
+
+def _with_retry(send, retries):
+    """
+    执行send()发送请求，连接失败时以随机退避重试至多retries次
     
-    # 检查文件是否存在
-    file_path = r"E:\software\MCP_Proj\100MCP\adf-master\OpenSSH_2k.log_structured.csv"
-    if not os.path.exists(file_path):
-        print(f"文件不存在: {file_path}")
-        return
+    只重试连接阶段的失败（含连接超时）：此时服务器尚未收到请求，重发不会重复提交任务；
+    读超时说明服务器已受理，直接抛出。重试耗尽后抛出最后一次的异常。
+    """
+    for attempt in range(retries + 1):
+        try:
+            return send()
+        except _CONNECT_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0.05, 0.15))
+
+
+def _error_preview(response, limit=512):
+    """只解码响应体的前limit字节用于诊断，避免完整解码大段错误页面"""
+    return response.content[:limit].decode("utf-8", "replace")
+
+
+def post_json(path, body, timeout=5, retries=1):
+    """向服务器POST JSON请求体"""
+    data = _dumps(body)
+    return _with_retry(
+        lambda: SESSION.post(path, content=data, headers={"Content-Type": "application/json"}, timeout=timeout),
+        retries
+    )
+
+
+def upload_file(path, fh, filename, body, timeout=SUBMIT_TIMEOUT, retries=1):
+    """以multipart/form-data上传已打开的文件及已序列化的分析参数，服务器无需访问客户端的文件路径"""
+    def send():
+        # 重试时从头重新发送同一个文件句柄
+        fh.seek(0)
+        # httpx按块读取文件对象生成multipart请求体，不会把整个文件读入内存
+        fields = {
+            "metadata": (None, body, "application/json"),
+            "file": (filename, fh, "text/csv"),
+        }
+        return SESSION.post(path, files=fields, timeout=timeout)
     
-    print(f"✅ 文件存在: {file_path}")
+    return _with_retry(send, retries)
+
+
+def _submit_analysis(file_path):
+    """构造分析请求并上传文件，返回提交响应（不输出，可在后台线程中执行）
     
-    # 服务器URL
-    base_url = "http://localhost:2230"
+    文件只打开一次：同一个句柄既用于fstat取指纹也用于上传，文件不存在时抛出FileNotFoundError
+    """
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    with os.fdopen(fd, "rb") as fh:
+        st = os.fstat(fd)
+        return _upload_analysis(file_path, fh, st)
+
+
+def _upload_analysis(file_path, fh, st):
+    """为已打开的文件拼接分析参数并上传：只有文件指纹部分在运行时生成"""
+    # 缓存键：文件大小、修改时间与请求参数的稳定摘要（内置hash()每个进程随机加盐，不能跨运行复用）。
+    # 文件与参数未变时，服务器直接返回上次的分析结果
+    cache_key = f"{st.st_size}:{st.st_mtime_ns}:{_ANALYSIS_DIGEST}"
+    body = _ANALYSIS_BODY_PREFIX + (
+        f',"file_size":{st.st_size},"cache_key":"{cache_key}"}}'
+    ).encode("utf-8")
+    return upload_file("/upload/adf_analyze_file", fh, os.path.basename(file_path), body)
+
+
+def test_file_analysis(submit_future=None):
+    """测试文件分析功能
     
-    print("\n🔍 测试文件分析功能...")
+    submit_future: 已在后台发起的提交（_submit_analysis的Future），为None时在此同步提交
+    """
     
-    # 测试分析请求
-    analysis_request = {
-        "file_path": file_path,
-        "file_type": "csv",
-        "analysis_type": "log_analysis",
-        "time_window": "1min",
-        "aggregation_method": "count",
-        "regression": "c",
-        "max_lags": 10,
-        "lags_method": "aic",
-        "save_model": True,
-        "model_name": "test_openssh_analysis"
-    }
+    file_path = TEST_FILE_PATH
+    print("\n🔍 测试文件分析功能...")
     
     try:
-        print("📤 发送分析请求...")
-        response = requests.post(f"{base_url}/tools/adf_analyze_file", json=analysis_request, timeout=10)
+        print("📤 上传文件并发送分析请求...")
+        # 文件由提交过程直接打开，不再单独检查是否存在
+        try:
+            if submit_future is not None:
+                response = submit_future.result()
+            else:
+                response = _submit_analysis(file_path)
+        except FileNotFoundError:
+            print(f"文件不存在: {file_path}")
+            return
+        
+        print(f"✅ 文件存在: {file_path}")
         
         if response.status_code == 200:
-            result = response.json()
+            result = _loads(response.content)
             print(f"✅ 请求成功!")
             print(f"   状态: {result['status']}")
             print(f"   任务ID: {result['task_id']}")
@@ -53,44 +171,54 @@ def test_file_analysis():
             print(f"\n⏳ 等待任务完成...")
             
             max_wait_time = 60  # 最大等待60秒
-            start_time = time.time()
+            # 截止时间用单调时钟计算，不受系统时间调整影响
+            start_time = time.perf_counter()
             
-            while time.time() - start_time < max_wait_time:
-                time.sleep(2)
-                
+            # 提交响应已附带任务快照，任务已结束时无需再请求get_task
+            task_info = result.get('initial_state') or {}
+            while task_info.get('status') not in ('succeeded', 'failed'):
+                remaining = max_wait_time - (time.perf_counter() - start_time)
+                if remaining <= 0:
+                    break
+                # 长轮询：服务器在任务成功或失败时才返回，超时后返回当前状态
                 try:
-                    task_response = requests.post(f"{base_url}/tools/get_task", json={"task_id": task_id}, timeout=5)
-                    
-                    if task_response.status_code == 200:
-                        task_info = task_response.json()
-                        progress = task_info.get('progress', 0)
-                        status = task_info.get('status', 'unknown')
-                        
-                        print(f"   进度: {progress:.1%} - 状态: {status}")
-                        
-                        if status == 'succeeded':
-                            print("\n🎉 分析完成!")
-                            print_analysis_result(task_info['result'])
-                            return True
-                        elif status == 'failed':
-                            print(f"\n❌ 分析失败: {task_info.get('error', '未知错误')}")
-                            return False
-                    else:
-                        print(f"   获取任务状态失败: {task_response.status_code}")
-                        
-                except requests.exceptions.RequestException as e:
-                    print(f"   请求异常: {e}")
-                    continue
+                    task_response = post_json(
+                        "/tasks/wait",
+                        {"task_id": task_id, "timeout": remaining},
+                        timeout=remaining + 5
+                    )
+                except httpx.TimeoutException:
+                    print(f"\n⏰ 等待超时 ({max_wait_time}秒)")
+                    return False
+                
+                if task_response.status_code != 200:
+                    print(f"   获取任务状态失败: {task_response.status_code}")
+                    print(f"   错误信息: {_error_preview(task_response)}")
+                    return False
+                
+                task_info = _loads(task_response.content)
+            
+            progress = task_info.get('progress', 0)
+            status = task_info.get('status', 'unknown')
+            sys.stdout.write(f"   进度: {progress:.1%} - 状态: {status}\n")
+            
+            if status == 'succeeded':
+                print("\n🎉 分析完成!")
+                print_analysis_result(task_info['result'])
+                return True
+            elif status == 'failed':
+                print(f"\n❌ 分析失败: {task_info.get('error', '未知错误')}")
+                return False
             
             print(f"\n⏰ 等待超时 ({max_wait_time}秒)")
             return False
             
         else:
             print(f"❌ 请求失败: {response.status_code}")
-            print(f"   错误信息: {response.text}")
+            print(f"   错误信息: {_error_preview(response)}")
             return False
             
-    except requests.exceptions.ConnectionError:
+    except _CONNECT_ERRORS:
         print("❌ 连接失败: 请确保MCP服务器正在运行 (python adf_mcp_server.py)")
         return False
     except Exception as e:
@@ -98,77 +226,119 @@ def test_file_analysis():
         return False
 
 
+def _fmt_number(value, spec):
+    """按spec格式化数值；缺失或非数值时返回'N/A'，避免对字符串套用数值格式"""
+    if isinstance(value, (int, float)):
+        return format(value, spec)
+    return 'N/A'
+
+
+class Default(dict):
+    """format_map用的字典：缺失的键填充为'N/A'"""
+    
+    def __missing__(self, key):
+        return 'N/A'
+
+
+# 报告模板在导入时构造一次；可选段落先渲染为字符串（缺省为空）再填入对应占位符
+_REPORT_HEADER = "\n" + "=" * 60 + "\n📊 分析结果\n" + "=" * 60 + "\n"
+
+_REPORT_TEMPLATE = """✅ 分析成功!
+📁 文件路径: {file_path}
+🔍 分析类型: {analysis_type}
+
+📈 数据摘要:
+   时间序列长度: {time_series_length}{time_range_section}{value_range_section}
+
+🔬 ADF检验结果:
+   统计量: {statistic}
+   p值: {p_value}
+   是否平稳: {stationary}
+   滞后阶数: {lags_used}
+   回归类型: {regression_description}
+   滞后方法: {lags_method_description}{interpretation_section}{recommendations_section}{model_section}
+"""
+
+_TIME_RANGE_TEMPLATE = """
+   时间范围: {start} 到 {end}"""
+
+_VALUE_RANGE_TEMPLATE = """
+   数值范围: {min} 到 {max}
+   平均值: {mean}
+   标准差: {std}"""
+
+_INTERPRETATION_TEMPLATE = """
+
+📝 结果解释:
+   {interpretation}"""
+
+_MODEL_TEMPLATE = """
+
+💾 模型已保存: {model_path}
+   {model_status}"""
+
+
 def print_analysis_result(result):
-    """打印分析结果"""
-    print("\n" + "=" * 60)
-    print("📊 分析结果")
-    print("=" * 60)
+    """按预构造的模板渲染分析结果，一次性写出"""
+    if result.get('status') != 'success':
+        sys.stdout.write(f"{_REPORT_HEADER}❌ 分析失败: {result.get('error', '未知错误')}\n")
+        sys.stdout.flush()
+        return
     
-    if result.get('status') == 'success':
-        print(f"✅ 分析成功!")
-        print(f"📁 文件路径: {result.get('file_path', 'N/A')}")
-        print(f"🔍 分析类型: {result.get('analysis_type', 'N/A')}")
-        
-        # 数据摘要
-        data_summary = result.get('data_summary', {})
-        print(f"\n📈 数据摘要:")
-        print(f"   时间序列长度: {data_summary.get('time_series_length', 'N/A')}")
-        
-        time_range = data_summary.get('time_range', {})
-        if time_range:
-            print(f"   时间范围: {time_range.get('start', 'N/A')} 到 {time_range.get('end', 'N/A')}")
-        
-        value_range = data_summary.get('value_range', {})
-        if value_range:
-            print(f"   数值范围: {value_range.get('min', 'N/A')} 到 {value_range.get('max', 'N/A')}")
-            print(f"   平均值: {value_range.get('mean', 'N/A'):.2f}")
-            print(f"   标准差: {value_range.get('std', 'N/A'):.2f}")
-        
-        # ADF检验结果
-        adf_result = result.get('adf_result', {})
-        print(f"\n🔬 ADF检验结果:")
-        print(f"   统计量: {adf_result.get('statistic', 'N/A'):.6f}")
-        print(f"   p值: {adf_result.get('p_value', 'N/A'):.6f}")
-        print(f"   是否平稳: {'是' if adf_result.get('is_stationary', False) else '否'}")
-        print(f"   滞后阶数: {adf_result.get('lags_used', 'N/A')}")
-        print(f"   回归类型: {adf_result.get('regression_description', 'N/A')}")
-        print(f"   滞后方法: {adf_result.get('lags_method_description', 'N/A')}")
-        
-        # 结果解释
-        interpretation = result.get('interpretation', '')
-        if interpretation:
-            print(f"\n📝 结果解释:")
-            print(f"   {interpretation}")
-        
-        # 建议
-        recommendations = result.get('recommendations', [])
-        if recommendations:
-            print(f"\n💡 分析建议:")
-            for i, rec in enumerate(recommendations, 1):
-                print(f"   {i}. {rec}")
-        
-        # 模型信息
-        model_path = result.get('model_path')
-        if model_path:
-            print(f"\n💾 模型已保存: {model_path}")
-            if os.path.exists(model_path):
-                print(f"   ✅ 模型文件存在")
-            else:
-                print(f"   ❌ 模型文件不存在")
+    ds = result.get('data_summary') or {}
+    tr = ds.get('time_range') or {}
+    vr = ds.get('value_range') or {}
+    adf = result.get('adf_result') or {}
+    
+    fields = Default(result)
+    fields.update(ds)
+    fields.update(adf)
+    fields['statistic'] = _fmt_number(adf.get('statistic'), '.6f')
+    fields['p_value'] = _fmt_number(adf.get('p_value'), '.6f')
+    fields['stationary'] = '是' if adf.get('is_stationary', False) else '否'
+    
+    fields['time_range_section'] = _TIME_RANGE_TEMPLATE.format_map(Default(tr)) if tr else ''
+    if vr:
+        value_fields = Default(vr)
+        value_fields['mean'] = _fmt_number(vr.get('mean'), '.2f')
+        value_fields['std'] = _fmt_number(vr.get('std'), '.2f')
+        fields['value_range_section'] = _VALUE_RANGE_TEMPLATE.format_map(value_fields)
     else:
-        print(f"❌ 分析失败: {result.get('error', '未知错误')}")
+        fields['value_range_section'] = ''
+    
+    interpretation = result.get('interpretation', '')
+    fields['interpretation_section'] = (
+        _INTERPRETATION_TEMPLATE.format_map({'interpretation': interpretation}) if interpretation else ''
+    )
+    
+    recommendations = result.get('recommendations', [])
+    fields['recommendations_section'] = (
+        "\n\n💡 分析建议:" + "".join(f"\n   {i}. {rec}" for i, rec in enumerate(recommendations, 1))
+        if recommendations else ''
+    )
+    
+    model_path = result.get('model_path')
+    if model_path:
+        model_status = "✅ 模型文件存在" if os.path.exists(model_path) else "❌ 模型文件不存在"
+        fields['model_section'] = _MODEL_TEMPLATE.format_map({'model_path': model_path, 'model_status': model_status})
+    else:
+        fields['model_section'] = ''
+    
+    sys.stdout.write(_REPORT_HEADER + _REPORT_TEMPLATE.format_map(fields))
+    sys.stdout.flush()
 
 
 def test_server_connection():
-    """测试服务器连接"""
-    base_url = "http://localhost:2230"
+    """测试服务器连接
     
+    连接由共享的SESSION建立并保持keep-alive，之后的长轮询直接复用，不再重新握手
+    """
     try:
         print("🔌 测试服务器连接...")
-        response = requests.get(f"{base_url}/", timeout=5)
+        response = _with_retry(lambda: SESSION.get("/", timeout=5), retries=1)
         print(f"✅ 服务器连接成功: {response.status_code}")
         return True
-    except requests.exceptions.ConnectionError:
+    except _CONNECT_ERRORS:
         print("❌ 服务器连接失败: 请启动MCP服务器")
         print("   启动命令: python adf_mcp_server.py")
         return False
@@ -181,12 +351,23 @@ if __name__ == "__main__":
     print("🧪 ADF文件分析功能测试")
     print("=" * 60)
     
-    # 测试服务器连接
-    if not test_server_connection():
-        exit(1)
-    
-    # 测试文件分析
-    success = test_file_analysis()
+    # 健康检查与首次提交互不依赖，并发发起以重叠两次建连的往返
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        health_future = ex.submit(test_server_connection)
+        submit_future = ex.submit(_submit_analysis, TEST_FILE_PATH)
+        try:
+            connected = health_future.result(timeout=HEALTH_CHECK_WAIT)
+        except FutureTimeoutError:
+            print(f"❌ 服务器连接超时 ({HEALTH_CHECK_WAIT}秒)")
+            connected = False
+        
+        if not connected:
+            submit_future.cancel()
+            SESSION.close()
+            exit(1)
+        
+        # 测试文件分析
+        success = test_file_analysis(submit_future)
     
     if success:
         print("\n🎉 所有测试通过!")